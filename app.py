@@ -1,36 +1,114 @@
 from __future__ import annotations
+import functools
+import hashlib
+import hmac
+import logging
 import os
-from dotenv import load_dotenv
-from flask import Flask, jsonify, request, render_template, redirect
-from itsdangerous import URLSafeSerializer
+import re
+import orjson
+from flask import Flask, jsonify, request, render_template, redirect, make_response
+from flask.json.provider import JSONProvider
+from infrastructure.env import ensure_env
+
+# --- Setup ---
+# Before importing services: that builds the Redis/S3 clients, which read
+# .env and log their startup config
+ensure_env()
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    format="%(asctime)s %(levelname)s [%(name)s] %(message)s",
+)
+logger = logging.getLogger(__name__)
+
 from services import AuthService, ImageService
 from services import redis_client
 
-# --- Setup ---
-load_dotenv()
+# --- JSON ---
+class ORJSONProvider(JSONProvider):
+    """
+    Swap Flask's stdlib json for orjson. This covers both jsonify() and
+    request.get_json(), which is where most of our per-request CPU goes.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # orjson already gives us bytes, no need to go through str first
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
+
+# --- App ---
 app = Flask(__name__, template_folder="template", static_folder="static")
+app.json = ORJSONProvider(app)
 
 app.config["SECRET_KEY"] = os.getenv("FLASK_SECRET", "dev-secret")
-signer = URLSafeSerializer(app.config["SECRET_KEY"], salt="api-key")
+# Image bytes go straight to S3, so we only ever receive small JSON bodies
+app.config["MAX_CONTENT_LENGTH"] = 64 * 1024
+# BLAKE2b keys max out at 64 bytes, so derive a fixed-size one from the secret
+_API_KEY_SECRET = hashlib.blake2b(app.config["SECRET_KEY"].encode(), digest_size=32).digest()
 
 # --- HTTP Helper functions ---
 def ok(payload, status=200): return jsonify(payload), status
 def err(code, message, status): return jsonify({"error": {"code": code, "message": message}}), status
 
 # --- Auth Middleware (HTTP Concern) ---
+def _sign_uid(uid: str) -> str:
+    return hashlib.blake2b(
+        uid.encode(), key=_API_KEY_SECRET, person=b"api-key", digest_size=16
+    ).hexdigest()
+
+def issue_api_key(uid: str) -> str:
+    """API keys look like `<uid>.<mac>` — no JSON or base64 to decode on every request."""
+    return f"{uid}.{_sign_uid(uid)}"
+
+# `u_<id>.<32 hex>`; anything else is rejected before it can reach the cache,
+# so junk headers can't fill it up and push out real keys
+_API_KEY_SHAPE = re.compile(r"u_[A-Za-z0-9_]{1,64}\.[0-9a-f]{32}")
+
+@functools.lru_cache(maxsize=10000)
+def _verify_api_key(token: str):
+    """Returns the uid a token was issued for, or None. Clients reuse the same key, so cache it."""
+    uid, _, sig = token.rpartition(".")
+    if not uid or not hmac.compare_digest(sig.encode(), _sign_uid(uid).encode()):
+        return None
+    return uid
+
 def require_api_key():
     token = (request.headers.get("X-API-Key") or "").strip()
-    if not token:
-        return None
-    try:
-        return signer.loads(token)
-    except Exception:
+    if not token or not _API_KEY_SHAPE.fullmatch(token):
         return None
+    uid = _verify_api_key(token)
+    return {"uid": uid} if uid else None
 
 # --- Frontend Route ---
+# index.html takes no context, so its output only changes when the file does.
+# Hash it once at startup and let browsers revalidate with If-None-Match.
+with open(os.path.join(app.root_path, app.template_folder, "index.html"), "rb") as f:
+    INDEX_ETAG = hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+
+@functools.lru_cache(maxsize=1)
+def _render_index() -> str:
+    # Rendered on the first request (url_for needs a request context), then reused
+    return render_template("index.html")
+
 @app.get("/")
 def serve_index():
-    return render_template("index.html")
+    if app.debug:
+        # Re-render and skip the startup ETag so template edits show up on reload
+        resp = make_response(render_template("index.html"))
+        resp.cache_control.no_cache = True
+        return resp
+
+    resp = make_response(_render_index())
+    resp.set_etag(INDEX_ETAG)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = 3600
+    # Turns into a bodyless 304 when the browser already has this version
+    return resp.make_conditional(request)
 
 @app.get("/health")
 def health_check():
@@ -38,16 +116,17 @@ def health_check():
 
 @app.get("/redis-check")
 def redis_check():
-    try:
-        return ok({"redis": bool(redis_client.ping())})
-    except Exception as e:
-        return err("redis_unreachable", str(e), 500)
+    # Served from the background health check, not a ping per request
+    healthy, error = redis_client.health()
+    if not healthy:
+        return err("redis_unreachable", error or "ping failed", 500)
+    return ok({"redis": True})
 
 # --- Auth Routes ---
 
 @app.post("/api/v1/register")
 def register():
-    data = request.json or {}
+    data = request.get_json(silent=True) or {}
     username = data.get("username")
     password = data.get("password")
     
@@ -59,12 +138,12 @@ def register():
         return err("conflict", result["error"], 409)
         
     # Generate token immediately so they are logged in
-    token = signer.dumps({"uid": result["uid"]})
+    token = issue_api_key(result["uid"])
     return ok({"api_key": token, "username": username})
 
 @app.post("/api/v1/login")
 def login():
-    data = request.json or {}
+    data = request.get_json(silent=True) or {}
     username = data.get("username")
     password = data.get("password")
     
@@ -75,7 +154,7 @@ def login():
     if not user:
         return err("auth", "Invalid username or password", 401)
         
-    token = signer.dumps({"uid": user["uid"]})
+    token = issue_api_key(user["uid"])
     return ok({"api_key": token, "username": user["username"]})
 
 # --- S3 Upload Routes ---
@@ -85,7 +164,7 @@ def request_upload():
     auth = require_api_key()
     if not auth: return err("auth", "invalid api key", 401)
     
-    req_data = request.json or {}
+    req_data = request.get_json(silent=True) or {}
     filename = req_data.get("filename")
     mime_type = req_data.get("mime_type")
 
@@ -96,8 +175,8 @@ def request_upload():
         # Delegate to Service Layer
         result = ImageService.initiate_upload(auth["uid"], filename, mime_type)
         return ok(result)
-    except Exception as e:
-        print(f"Error: {e}")
+    except Exception:
+        logger.exception("Could not initiate upload for uid=%s", auth["uid"])
         return err("service_error", "Could not initiate upload.", 500)
 
 @app.post("/api/v1/upload/complete")
@@ -105,27 +184,25 @@ def complete_upload():
     auth = require_api_key()
     if not auth: return err("auth", "invalid api key", 401)
     
-    req_data = request.json or {}
+    req_data = request.get_json(silent=True) or {}
     
-    # Validation
-    required = ["iid", "key", "filename", "mime_type"]
-    if not all(k in req_data for k in required):
+    # Validation (key/filename/mime_type were fixed at request time)
+    iid = req_data.get("iid")
+    if not iid or not isinstance(iid, str):
         return err("validation", "missing required fields", 400)
 
     try:
         # Delegate to Service Layer
-        result = ImageService.finalize_upload(
-            auth["uid"], 
-            req_data["iid"], 
-            req_data["key"], 
-            req_data["filename"], 
-            req_data["mime_type"]
-        )
-        return ok(result, 201)
-    except Exception as e:
-        print(f"Error: {e}")
+        result = ImageService.finalize_upload(auth["uid"], iid)
+    except Exception:
+        logger.exception("Could not save upload metadata for iid=%s", iid)
         return err("save_error", "Could not save upload metadata", 500)
 
+    if "error" in result:
+        return err(result["error"], "Unknown or expired upload", result.get("code", 500))
+
+    return ok(result, 201)
+
 # --- Gallery Routes ---
 
 @app.get("/api/v1/me/images")
@@ -150,6 +227,7 @@ def get_image(iid):
     except ValueError:
         return err("invalid_record", "Image record is corrupt", 500)
     except Exception:
+        logger.exception("S3 operation failed on iid=%s", iid)
         return err("s3_error", "Could not get image URL", 500)
 
 # --- Delete Route ---
@@ -167,6 +245,29 @@ def delete_image(iid):
         
     return ok({"status": "deleted", "id": iid})
 
+# Upper bound on how many images one bulk delete can touch
+MAX_BULK_DELETE = 1000
+
+@app.delete("/api/v1/me/images")
+def delete_my_images():
+    auth = require_api_key()
+    if not auth: return err("auth", "invalid api key", 401)
+
+    req_data = request.get_json(silent=True) or {}
+    ids = req_data.get("ids")
+    if not isinstance(ids, list) or not ids or not all(isinstance(i, str) for i in ids):
+        return err("validation", "ids must be a non-empty list of image IDs", 400)
+    if len(ids) > MAX_BULK_DELETE:
+        return err("validation", f"at most {MAX_BULK_DELETE} ids per request", 400)
+
+    # Service skips anything the caller doesn't own
+    result = ImageService.delete_images(ids, auth["uid"])
+
+    if "error" in result:
+        return err(result["error"], "Operation failed", result.get("code", 500))
+
+    return ok(result)
+
 # --- Run the app ---
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 80))
@@ -120,7 +120,8 @@ if [ "$USER" == "ec2-user" ] || [ "$USER" == "ubuntu" ]; then
         sleep 1
     fi
     echo "Starting Gunicorn on Port 8000..."
-    nohup gunicorn -w 4 -b 0.0.0.0:8000 app:app > app.log 2>&1 &
+    # Worker count/class live in gunicorn.conf.py
+    nohup gunicorn -c gunicorn.conf.py app:app > app.log 2>&1 &
 else
     python3 app.py
 fi
@@ -0,0 +1,24 @@
+"""
+Gunicorn settings for production. deploy.sh starts the app with:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Every knob can be overridden from the environment (or .env).
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+
+# Classic sizing rule: two workers per core, plus one
+workers = int(os.getenv("GUNICORN_WORKERS", 2 * multiprocessing.cpu_count() + 1))
+
+# Requests mostly wait on Redis/S3, so each worker should juggle several.
+# gthread needs nothing extra; GUNICORN_WORKER_CLASS=gevent switches to green
+# threads (pip install gevent first).
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 1000))
+
+# Nginx sits in front of us, so keep idle upstream connections around briefly
+keepalive = 5
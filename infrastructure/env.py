@@ -0,0 +1,19 @@
+import threading
+
+from dotenv import load_dotenv
+
+# .env only needs parsing once per process, and only by whoever actually
+# needs config (client constructors, the app entry point), not on import.
+_loaded = False
+_lock = threading.Lock()
+
+
+def ensure_env() -> None:
+    """Load .env into os.environ the first time it's called. Real env vars win."""
+    global _loaded
+    if _loaded:
+        return
+    with _lock:
+        if not _loaded:
+            load_dotenv(override=False)
+            _loaded = True
@@ -1,9 +1,82 @@
 import os
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from typing import List, Dict, Any, Optional, Tuple
 import redis
-from dotenv import load_dotenv
+from infrastructure.env import ensure_env
 
-load_dotenv()
+# How often the background health check pings Redis (seconds)
+HEALTH_CHECK_INTERVAL = 5
+
+# Server-side scripts. These hard-code the "img:" prefix from _k_img().
+
+# Newest-first image IDs plus the requested fields of each image, all in one
+# round-trip. ARGV[1] is the limit, the rest are field names for HMGET.
+GALLERY_LUA = """
+local ids = redis.call('ZREVRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+local out = {}
+for _, id in ipairs(ids) do
+    out[#out + 1] = redis.call('HMGET', 'img:' .. id, unpack(ARGV, 2))
+end
+return out
+"""
+
+# What the gallery actually shows; views/private/owner_uid stay in Redis
+GALLERY_FIELDS = ["id", "key", "url", "filename", "mime", "created_at"]
+
+# Creates the user hash only if it doesn't exist yet, in one round-trip.
+# ARGV = username, uid, created_at.
+CREATE_USER_LUA = """
+if redis.call('HSETNX', KEYS[1], 'username', ARGV[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'uid', ARGV[2], 'created_at', ARGV[3])
+return 1
+"""
+
+# Claims the username and writes the account in one atomic step, so two
+# racing sign-ups can't both get the same name.
+# KEYS = username:<name>, user:<uid>. ARGV = uid, username, password_hash, created_at.
+REGISTER_USER_LUA = """
+if not redis.call('SET', KEYS[1], ARGV[1], 'NX') then
+    return 0
+end
+redis.call('HSET', KEYS[2], 'uid', ARGV[1], 'username', ARGV[2],
+           'password_hash', ARGV[3], 'created_at', ARGV[4])
+return 1
+"""
+
+# Writes the image hash, adds it to the owner's gallery and clears the
+# pending-upload marker, atomically.
+# ARGV[1] = iid, ARGV[2] = score (created_at), then field/value pairs.
+STORE_IMAGE_LUA = """
+redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[1])
+redis.call('DEL', KEYS[3])
+return 1
+"""
+
+# Only deletes if the requester still owns the image, so the ownership
+# check and the delete can't race each other.
+DELETE_OWNED_LUA = """
+if redis.call('HGET', KEYS[1], 'owner_uid') ~= ARGV[2] then
+    return 0
+end
+redis.call('DEL', KEYS[1], KEYS[3])
+redis.call('ZREM', KEYS[2], ARGV[1])
+return 1
+"""
+
+# Caches a download link only while the image still exists, so a view that
+# races a delete can't leave a link to a dead object behind.
+# KEYS = presign:<iid>, img:<iid>. ARGV = url, ttl.
+CACHE_PRESIGN_LUA = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
 
 class RedisClient:
     """
@@ -12,11 +85,40 @@ class RedisClient:
     """
 
     def __init__(self, url: Optional[str] = None, decode_responses: bool = True):
+        ensure_env()
+
         # Either use the env variable, or just assume Redis is running locally
         self.redis_url = url or os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
-        # This is the actual Redis connection the whole app uses
-        self._r = redis.from_url(self.redis_url, decode_responses=decode_responses)
+        # This is the actual Redis connection the whole app uses.
+        # BlockingConnectionPool makes threads wait for a free connection
+        # instead of opening unbounded new ones under load. Replies are parsed
+        # by hiredis (C) whenever it's installed.
+        # Keepalive + a health check stop idle pooled connections from going
+        # stale behind a NAT/LB; the timeouts turn a hung Redis into an error
+        # instead of a stuck worker thread.
+        pool = redis.BlockingConnectionPool.from_url(
+            self.redis_url,
+            max_connections=int(os.getenv("REDIS_POOL", "50")),
+            decode_responses=decode_responses,
+            socket_keepalive=True,
+            health_check_interval=30,
+            socket_connect_timeout=2.0,
+            socket_timeout=float(os.getenv("REDIS_TIMEOUT", "5")),
+        )
+        self._r = redis.Redis(connection_pool=pool)
+
+        # Scripts get cached by SHA on the server, so calls are just EVALSHA
+        self._create_user_script = self._r.register_script(CREATE_USER_LUA)
+        self._register_user_script = self._r.register_script(REGISTER_USER_LUA)
+        self._gallery_script = self._r.register_script(GALLERY_LUA)
+        self._store_image_script = self._r.register_script(STORE_IMAGE_LUA)
+        self._delete_owned_script = self._r.register_script(DELETE_OWNED_LUA)
+        self._cache_presign_script = self._r.register_script(CACHE_PRESIGN_LUA)
+
+        # (ok, error) from the last background ping; None until health() is first used
+        self._health: Optional[Tuple[bool, Optional[str]]] = None
+        self._health_lock = threading.Lock()
 
  
     # Internal key helpers
@@ -26,6 +128,10 @@ class RedisClient:
     def _k_user(uid: str) -> str:
         return f"user:{uid}"
 
+    @staticmethod
+    def _k_username(username: str) -> str:
+        return f"username:{username}"
+
     @staticmethod
     def _k_user_images(uid: str) -> str:
         return f"user:{uid}:images"
@@ -34,21 +140,44 @@ class RedisClient:
     def _k_img(iid: str) -> str:
         return f"img:{iid}"
 
+    @staticmethod
+    def _k_presign(iid: str) -> str:
+        return f"presign:{iid}"
+
+    @staticmethod
+    def _k_pending(iid: str) -> str:
+        return f"pending:{iid}"
+
     
     # User Operations
-    def create_user(self, uid: str, username: str, created_at: float) -> None:
+    def create_user(self, uid: str, username: str, created_at: float) -> bool:
         """
         Creates a user record in Redis. There's no "tables" so we just stuff it
-        into a Redis hash.
+        into a Redis hash. Returns False if that uid already had a record.
         """
-        # hsetnx = only set the username if it doesn't already exist
-        self._r.hsetnx(self._k_user(uid), "username", username)
+        # HSETNX + HSET in one script so it's one round-trip and atomic
+        created = self._create_user_script(
+            keys=[self._k_user(uid)],
+            args=[username, uid, created_at],
+        )
+        return bool(created)
 
-        # Store other info (uid and created_at)
-        self._r.hset(self._k_user(uid), mapping={
-            "uid": uid,
-            "created_at": created_at
-        })
+    def register_user(
+        self, uid: str, username: str, password_hash: str, created_at: float
+    ) -> bool:
+        """
+        Creates an account with a login. Returns False (and writes nothing)
+        if the username is already taken.
+        """
+        created = self._register_user_script(
+            keys=[self._k_username(username), self._k_user(uid)],
+            args=[uid, username, password_hash, created_at],
+        )
+        return bool(created)
+
+    def set_password_hash(self, uid: str, password_hash: str) -> None:
+        """Replaces a user's stored password hash (e.g. after a rehash on login)."""
+        self._r.hset(self._k_user(uid), "password_hash", password_hash)
 
    
     # Image Operations
@@ -63,13 +192,30 @@ class RedisClient:
         created_at: float,
     ) -> None:
         """
-        Saves image metadata AND links it to the user.
-        Pipeline is used so Redis runs everything in one go.
+        Saves image metadata AND links it to the user (and drops the pending
+        upload record, if any). A Lua script does it all, so it's atomic and
+        comes back as one reply.
         """
-        pipe = self._r.pipeline()
+        self._run_store_image(iid, owner_uid, key, url, filename, mime_type, created_at)
 
-        # Save the image metadata
-        pipe.hset(self._k_img(iid), mapping={
+    def store_images_bulk(self, records: List[Dict[str, Any]]) -> None:
+        """
+        Bulk version of store_image(). Each record has the same keys as
+        store_image()'s arguments; every store is still one atomic script,
+        but they all go out in one pipeline.
+        """
+        if not records:
+            return
+
+        pipe = self._r.pipeline(transaction=False)
+        for rec in records:
+            self._run_store_image(client=pipe, **rec)
+        pipe.execute()
+
+    def _run_store_image(
+        self, iid, owner_uid, key, url, filename, mime_type, created_at, client=None
+    ):
+        mapping = {
             "id": iid,
             "owner_uid": owner_uid,
             "key": key,
@@ -79,13 +225,38 @@ class RedisClient:
             "private": 1,
             "created_at": created_at,
             "views": 0
-        })
+        }
+        flat = [item for pair in mapping.items() for item in pair]
 
-        # Add it to the user's sorted set for gallery order
-        pipe.zadd(self._k_user_images(owner_uid), {iid: created_at})
+        # Hash for the metadata, sorted set (scored by created_at) for gallery order
+        self._store_image_script(
+            keys=[self._k_img(iid), self._k_user_images(owner_uid), self._k_pending(iid)],
+            args=[iid, created_at, *flat],
+            client=client,
+        )
 
+    # Pending uploads (presigned but not completed yet)
+    def store_pending_upload(
+        self, iid: str, owner_uid: str, key: str, filename: str, mime_type: str, ttl: int
+    ) -> None:
+        """
+        Remember what we handed out in the upload request, so the complete
+        step doesn't have to trust (or re-clean) whatever the client sends back.
+        """
+        pipe = self._r.pipeline()
+        pipe.hset(self._k_pending(iid), mapping={
+            "owner_uid": owner_uid,
+            "key": key,
+            "filename": filename,
+            "mime": mime_type,
+        })
+        pipe.expire(self._k_pending(iid), ttl)
         pipe.execute()
 
+    def get_pending_upload(self, iid: str) -> Dict[str, Any]:
+        """Gets a pending upload record ({} if it never existed or expired)."""
+        return self._r.hgetall(self._k_pending(iid))
+
     def get_image(self, iid: str) -> Dict[str, Any]:
         """Gets one image and returns its data as a dict."""
         return self._r.hgetall(self._k_img(iid))
@@ -107,20 +278,112 @@ class RedisClient:
             pipe.hgetall(self._k_img(iid))
         return pipe.execute()
 
-    def delete_image(self, iid: str, uid: str) -> None:
+    def get_image_fields(self, iid: str, fields: List[str]) -> Dict[str, Optional[str]]:
+        """Gets just the listed fields of one image (HMGET). Missing fields are None."""
+        return dict(zip(fields, self._r.hmget(self._k_img(iid), fields)))
+
+    def get_user_gallery(self, uid: str, limit: int = 50) -> List[Dict[str, Any]]:
         """
-        Deletes image metadata AND removes it from the user's list.
-        Both happen inside the same pipeline.
+        Like get_user_images() + get_images_batch(), but Redis does both steps
+        in a Lua script so it only costs one round-trip. Only GALLERY_FIELDS
+        come back; images that have vanished come back as {}.
         """
+        raw = self._gallery_script(
+            keys=[self._k_user_images(uid)], args=[limit, *GALLERY_FIELDS]
+        )
+        return [
+            dict(zip(GALLERY_FIELDS, values)) if any(values) else {}
+            for values in raw
+        ]
+
+    def get_images_fields(self, iids: List[str], fields: List[str]) -> List[Dict[str, Optional[str]]]:
+        """
+        Like get_images_batch(), but only pulls the fields we ask for (HMGET).
+        Missing images come back with every field set to None.
+        """
+        if not iids:
+            return []
+
         pipe = self._r.pipeline()
-        pipe.delete(self._k_img(iid))
-        pipe.zrem(self._k_user_images(uid), iid)
-        pipe.execute()
+        for iid in iids:
+            pipe.hmget(self._k_img(iid), fields)
+        return [dict(zip(fields, values)) for values in pipe.execute()]
+
+    def delete_image(self, iid: str, uid: str) -> bool:
+        """
+        Deletes image metadata AND removes it from the user's list, but only
+        if `uid` owns it. Returns False if it wasn't theirs (or was already gone).
+        """
+        deleted = self._delete_owned_script(
+            keys=[self._k_img(iid), self._k_user_images(uid), self._k_presign(iid)],
+            args=[iid, uid],
+        )
+        return bool(deleted)
+
+    def delete_images(self, iids: List[str], uid: str) -> List[bool]:
+        """
+        Bulk version of delete_image(). Every delete still checks ownership
+        atomically, but they all go out in one pipeline.
+        """
+        if not iids:
+            return []
+
+        pipe = self._r.pipeline()
+        for iid in iids:
+            self._delete_owned_script(
+                keys=[self._k_img(iid), self._k_user_images(uid), self._k_presign(iid)],
+                args=[iid, uid],
+                client=pipe,
+            )
+        return [bool(deleted) for deleted in pipe.execute()]
+
+    # Presigned URL cache
+    def get_presigned_url(self, iid: str) -> Optional[str]:
+        """Returns the cached download link for an image, if it's still around."""
+        return self._r.get(self._k_presign(iid))
+
+    def cache_presigned_url(self, iid: str, url: str, ttl: int) -> bool:
+        """
+        Remember a download link so repeat views skip re-signing.
+        The TTL should be shorter than the link's own expiry. Returns False
+        (and caches nothing) if the image was deleted in the meantime.
+        """
+        cached = self._cache_presign_script(
+            keys=[self._k_presign(iid), self._k_img(iid)],
+            args=[url, ttl],
+        )
+        return bool(cached)
 
     def ping(self) -> bool:
         """Simple check to confirm Redis is up and alive."""
         return self._r.ping()
 
+    def health(self) -> Tuple[bool, Optional[str]]:
+        """
+        Last known Redis status as (ok, error). The first call pings inline and
+        starts a background thread that re-checks every HEALTH_CHECK_INTERVAL
+        seconds, so health probes don't each cost a Redis round-trip.
+        """
+        if self._health is None:
+            with self._health_lock:
+                if self._health is None:
+                    self._check_health()
+                    threading.Thread(
+                        target=self._health_loop, name="redis-health", daemon=True
+                    ).start()
+        return self._health
+
+    def _check_health(self) -> None:
+        try:
+            self._health = (bool(self.ping()), None)
+        except Exception as e:
+            self._health = (False, str(e))
+
+    def _health_loop(self) -> None:
+        while True:
+            time.sleep(HEALTH_CHECK_INTERVAL)
+            self._check_health()
+
 
 
 
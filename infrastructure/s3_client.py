@@ -1,13 +1,26 @@
+import functools
+import logging
 import os
-from typing import Optional
+import threading
+from typing import List, Optional
 from urllib.parse import quote
 
 import boto3
 from botocore.config import Config
-from botocore.exceptions import ClientError
-from dotenv import load_dotenv
+from botocore.exceptions import BotoCoreError, ClientError
+from infrastructure.env import ensure_env
 
-load_dotenv()
+logger = logging.getLogger(__name__)
+
+# S3 caps DeleteObjects at 1000 keys per request
+DELETE_BATCH_SIZE = 1000
+
+
+# Keys never change once stored, and a gallery reload asks for the same
+# ones again, so remember how each one quotes.
+@functools.lru_cache(maxsize=50_000)
+def _quote_key(key: str) -> str:
+    return quote(key, safe="/")
 
 
 class S3Client:
@@ -16,7 +29,12 @@ class S3Client:
     Instead of calling boto3 all over the project, we just use this one class.
     """
 
+    _instance: Optional["S3Client"] = None
+    _instance_lock = threading.Lock()
+
     def __init__(self, region: Optional[str] = None, bucket_name: Optional[str] = None):
+        ensure_env()
+
         # Pull settings from the environment so we don’t hard-code secrets
         self.region = region or os.getenv("AWS_REGION", "us-east-1")
         self.bucket_name = bucket_name or os.getenv("AWS_S3_BUCKET_NAME")
@@ -25,13 +43,57 @@ class S3Client:
           
             raise ValueError("AWS_S3_BUCKET_NAME environment variable not set.")
 
-        # Real boto3 S3 client that actually talks to AWS
+        # Real boto3 S3 client that actually talks to AWS.
+        # A bigger keep-alive pool means deletes under load reuse TLS
+        # connections instead of handshaking every time. botocore resolves
+        # the endpoint from its bundled data (partitions, FIPS, dualstack)
+        # unless AWS_ENDPOINT_URL(_S3) points us somewhere else (MinIO,
+        # LocalStack). On AWS, virtual addressing keeps links on the
+        # regional https://<bucket>.s3.<region>... host; custom endpoints
+        # keep botocore's default, since they often can't do bucket subdomains.
+        custom_endpoint = os.getenv("AWS_ENDPOINT_URL_S3") or os.getenv("AWS_ENDPOINT_URL")
         self._s3 = boto3.client(
             "s3",
             region_name=self.region,
-            config=Config(signature_version="s3v4"),
+            endpoint_url=custom_endpoint,
+            config=Config(
+                signature_version="s3v4",
+                s3={"addressing_style": "auto" if custom_endpoint else "virtual"},
+                max_pool_connections=64,
+                tcp_keepalive=True,
+                retries={"mode": "standard", "max_attempts": 3},
+            ),
         )
-        print(f"[S3Client] Using bucket={self.bucket_name} region={self.region}")
+        logger.info("Using bucket=%s region=%s", self.bucket_name, self.region)
+
+        self._warm_signer()
+
+    def _warm_signer(self) -> None:
+        """
+        botocore builds the SigV4 signer lazily on the first presign call.
+        Do that once now so the first real upload doesn't pay for it.
+        """
+        try:
+            self._s3.generate_presigned_url(
+                "get_object",
+                Params={"Bucket": self.bucket_name, "Key": "__warm__"},
+                ExpiresIn=60,
+            )
+        except (BotoCoreError, ClientError):
+            # No credentials yet (tests, local dev) — the real call will complain later
+            pass
+
+    @classmethod
+    def get(cls) -> "S3Client":
+        """
+        The shared client for this process. Everyone going through here means
+        one boto3 client, so one connection pool and one warmed-up signer.
+        """
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
 
     # URL helpers
     def get_s3_url(self, key: str) -> str:
@@ -43,7 +105,7 @@ class S3Client:
         Public https URL.
         This only works if the bucket/object is readable (like for a public gallery).
         """
-        safe_key = quote(key, safe="/")
+        safe_key = _quote_key(key)
         return f"https://{self.bucket_name}.s3.amazonaws.com/{safe_key}"
 
     # Presigned URLs
@@ -69,6 +131,8 @@ class S3Client:
         """
         Create a temporary download link.
         Good for private images because the link expires after a while.
+        S3 sends Cache-Control back for the link's lifetime, so browsers
+        don't re-download an image they already have.
         """
         try:
             return self._s3.generate_presigned_url(
@@ -76,6 +140,7 @@ class S3Client:
                 Params={
                     "Bucket": self.bucket_name,
                     "Key": key,
+                    "ResponseCacheControl": f"private, max-age={expires_in}",
                 },
                 ExpiresIn=expires_in,
             )
@@ -89,3 +154,21 @@ class S3Client:
             self._s3.delete_object(Bucket=self.bucket_name, Key=key)
         except ClientError as e:
             raise Exception(f"S3 DELETE Error: {e}") from e
+
+    def delete_objects(self, keys: List[str]) -> List[str]:
+        """
+        Delete a bunch of files with as few requests as possible
+        (one per 1000 keys). Returns the keys S3 refused to delete.
+        """
+        failed = []
+        try:
+            for start in range(0, len(keys), DELETE_BATCH_SIZE):
+                batch = keys[start:start + DELETE_BATCH_SIZE]
+                resp = self._s3.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={"Objects": [{"Key": k} for k in batch], "Quiet": True},
+                )
+                failed.extend(e["Key"] for e in resp.get("Errors", []))
+        except ClientError as e:
+            raise Exception(f"S3 DELETE Error: {e}") from e
+        return failed
@@ -3,16 +3,74 @@ Service layer: This is where the *actual business logic* lives.
 The Flask app shouldn’t be doing heavy lifting — it should just forward requests here.
 """
 
-import uuid
+import functools
+import logging
 import os
 import re
+import secrets
+import threading
 import unicodedata
 import time
+from cachetools import TTLCache
 from infrastructure.redis_client import RedisClient
 from infrastructure.s3_client import S3Client
 
+logger = logging.getLogger(__name__)
+
 redis_client = RedisClient()
-s3_client = S3Client()
+s3_client = S3Client.get()
+
+# Download links are valid for an hour; we cache them a little less than
+# that so nobody gets handed a link that's about to die.
+PRESIGN_EXPIRES = 3600
+PRESIGN_CACHE_TTL = PRESIGN_EXPIRES - 300
+
+# Hot images skip Redis entirely: each worker also keeps recent links in
+# memory for a short while. TTLCache isn't thread-safe, hence the lock.
+LOCAL_URL_CACHE_TTL = 30
+_url_cache = TTLCache(maxsize=10_000, ttl=LOCAL_URL_CACHE_TTL)
+_url_cache_lock = threading.Lock()
+
+# Upload links last an hour too, and the pending record lives exactly as long
+UPLOAD_EXPIRES = 3600
+
+# Filename cleanup substitutions, compiled once and bound to .sub so each
+# call is a single lookup. The "+" drops a whole run of bad chars per match.
+_SAFE_NAME_SUB = re.compile(r"[^A-Za-z0-9._-]+").sub
+_SAFE_EXT_SUB = re.compile(r"[^a-z0-9]+").sub
+# Names made only of these (most camera/phone names) don't need the regex at all
+_SAFE_NAME_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789._-")
+
+# Normalize / strip accents
+def _to_ascii(value: str) -> str:
+    # Plain ASCII is already NFKD (most names, e.g. IMG_1234.jpg), so skip the tables
+    if value.isascii():
+        return value
+    normalized = unicodedata.normalize("NFKD", value)
+    return normalized.encode("ascii", "ignore").decode()
+
+def _fix_gallery_url(data, public_url):
+    """
+    Clean or rebuild a gallery item's URL when needed. Redis might store
+    older URLs (s3://, with fragments, or none at all).
+    """
+    url = data.get("url")
+    key = data.get("key")
+
+    if key and (not url or url.startswith("s3://") or "#" in url):
+        data["url"] = url = public_url(key)
+
+    # If URL is completely missing, fallback to app proxy
+    if not url:
+        data["url"] = f"/api/v1/image/{data['id']}"
+
+    return data
+
+def _forget_urls(iids):
+    """Drop this worker's cached download links (Redis clears its own copy)."""
+    with _url_cache_lock:
+        for iid in iids:
+            _url_cache.pop(iid, None)
 
 # Helper to get timestamps in seconds
 def now():
@@ -22,68 +80,73 @@ def now():
 class Utils:
 
     @staticmethod
+    @functools.lru_cache(maxsize=4096)
     def sanitize_filename(filename: str, max_len: int = 120) -> str:
-        """Normalize filenames so S3 keys are URL-safe and consistent."""
+        """
+        Normalize filenames so S3 keys are URL-safe and consistent.
+        Everything goes through NFKD -> ASCII, so "é" and "e\u0301" end up as
+        the same name. The result only depends on the input, so we cache it.
+        """
         filename = filename or "file"
         name, ext = os.path.splitext(filename)
 
-        # Normalize / strip accents
-        def normalize(value: str) -> str:
-            normalized = unicodedata.normalize("NFKD", value)
-            return normalized.encode("ascii", "ignore").decode()
-
         # Clean the base name
-        safe_name = normalize(name)
-        safe_name = re.sub(r"[^A-Za-z0-9._-]+", "-", safe_name).strip("-._").lower()
+        safe_name = _to_ascii(name)
+        if not _SAFE_NAME_CHARS.issuperset(safe_name):
+            safe_name = _SAFE_NAME_SUB("-", safe_name)
+        safe_name = safe_name.strip("-._").lower()
         if not safe_name:
             safe_name = "file"
 
         safe_name = safe_name[:max_len]
 
         # Clean the extension
-        safe_ext = normalize(ext).lower()
-        safe_ext = re.sub(r"[^a-z0-9]", "", safe_ext)
+        safe_ext = _to_ascii(ext).lower()
+        safe_ext = _SAFE_EXT_SUB("", safe_ext)
         safe_ext = f".{safe_ext}" if safe_ext else ""
 
         return f"{safe_name}{safe_ext}"
 
 
-from werkzeug.security import generate_password_hash, check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from werkzeug.security import check_password_hash
+
+# The OWASP minimum Argon2id settings: about 40 ms of CPU per hash, against
+# 0.1-0.5 s for werkzeug's scrypt/PBKDF2 defaults. Both run in C either way;
+# the win is how much CPU each login burns.
+_password_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
 
 
+def hash_password(password: str) -> str:
+    return _password_hasher.hash(password)
+
+
+def verify_password(stored_hash: str, password: str) -> bool:
+    """Checks a password against our argon2 hashes or older werkzeug ones."""
+    if not stored_hash.startswith("$argon2"):
+        return check_password_hash(stored_hash, password)
+    try:
+        return _password_hasher.verify(stored_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
 
 class AuthService:
     @staticmethod
     def register_user(username, password):
         """
         Creates a new user with a password.
-        1. Check if username exists.
-        2. Create UID.
-        3. Save username->uid mapping.
-        4. Save user data with hashed password.
+        1. Create UID.
+        2. Hash the password.
+        3. Claim the username and save the user data in one atomic step
+           (fails if the username is taken).
         """
-        # 1. Check if username is taken (we use a simple redis key for this)
-        if redis_client._r.exists(f"username:{username}"):
-            return {"error": "Username already exists"}
-
-        uid = f"u_{uuid.uuid4().hex[:8]}"
-        password_hash = generate_password_hash(password)
+        uid = f"u_{secrets.token_hex(4)}"
+        password_hash = hash_password(password)
 
-        # 2. Transaction to save everything
-        pipe = redis_client._r.pipeline()
-        
-        # Save the lookup index: username -> uid
-        pipe.set(f"username:{username}", uid)
-        
-        # Save the user data
-        pipe.hset(f"user:{uid}", mapping={
-            "uid": uid,
-            "username": username,
-            "password_hash": password_hash,
-            "created_at": now()
-        })
-        
-        pipe.execute()
+        if not redis_client.register_user(uid, username, password_hash, now()):
+            return {"error": "Username already exists"}
 
         return {"uid": uid, "username": username}
 
@@ -98,18 +161,22 @@ class AuthService:
             return None # User not found
 
         # 2. Get the password hash
-        user_data = redis_client.get_image(uid.replace("u_", "user:")) # reusing get_image helper which is basically hgetall
-        # Or better, just use raw redis here since get_image expects img: prefix
         user_data = redis_client._r.hgetall(f"user:{uid}")
         
         if not user_data or "password_hash" not in user_data:
             return None
 
         # 3. Verify password
-        if check_password_hash(user_data["password_hash"], password):
-            return {"uid": uid, "username": username}
-        
-        return None
+        stored_hash = user_data["password_hash"]
+        if not verify_password(stored_hash, password):
+            return None
+
+        # Move older (werkzeug) or weaker hashes to the current settings
+        # now that we have the plaintext
+        if not stored_hash.startswith("$argon2") or _password_hasher.check_needs_rehash(stored_hash):
+            redis_client.set_password_hash(uid, hash_password(password))
+
+        return {"uid": uid, "username": username}
 
 class ImageService:
     """
@@ -125,15 +192,18 @@ class ImageService:
         - generate image ID
         - build the S3 key path
         - ask S3 for a presigned upload URL
+        - remember all of the above until the upload is completed
         """
         safe_filename = Utils.sanitize_filename(filename)
-        iid = f"img_{uuid.uuid4().hex[:12]}"
+        iid = f"img_{secrets.token_hex(6)}"
 
         # Storing everything under uploads/<user>/<imageID>/<filename>
         key = f"uploads/{uid}/{iid}/{safe_filename}"
 
         # Ask S3 to give us a temporary upload link
-        presigned_url = s3_client.generate_presigned_upload_url(key, mime_type)
+        presigned_url = s3_client.generate_presigned_upload_url(key, mime_type, expires_in=UPLOAD_EXPIRES)
+
+        redis_client.store_pending_upload(iid, uid, key, safe_filename, mime_type, UPLOAD_EXPIRES)
 
         return {
             "iid": iid,
@@ -143,11 +213,21 @@ class ImageService:
         }
 
     @staticmethod
-    def finalize_upload(uid: str, iid: str, key: str, filename: str, mime_type: str):
+    def finalize_upload(uid: str, iid: str):
         """
         Step 2 of uploading:
         The image is already in S3 — now we save the metadata to Redis.
+        Key, filename and MIME type come from the pending record written in
+        step 1, so the client can't swap them (or someone else's upload) in.
         """
+        pending = redis_client.get_pending_upload(iid)
+        if not pending:
+            return {"error": "not_found", "code": 404}
+
+        if pending.get("owner_uid") != uid:
+            return {"error": "forbidden", "code": 403}
+
+        key = pending["key"]
         public_url = s3_client.get_public_url(key)
 
         redis_client.store_image(
@@ -155,8 +235,8 @@ class ImageService:
             uid,
             key,
             public_url,
-            filename,
-            mime_type,
+            pending["filename"],
+            pending["mime"],
             now()
         )
 
@@ -168,34 +248,30 @@ class ImageService:
         Pull all images for the user and make sure URLs are actually usable.
         Redis might store older URLs, so we fix/refresh as needed.
         """
-        iids = redis_client.get_user_images(uid, limit=50)
-        results = redis_client.get_images_batch(iids)
-
-        clean_items = []
-        for data in results:
-            if not data:
-                continue
-
-            url = data.get("url")
-            key = data.get("key")
-
-            # Clean or rebuild URLs when needed
-            if key and (not url or url.startswith("s3://") or "#" in url):
-                data["url"] = s3_client.get_public_url(key)
+        results = redis_client.get_user_gallery(uid, limit=50)
 
-            # If URL is completely missing, fallback to app proxy
-            if not data.get("url"):
-                data["url"] = f"/api/v1/image/{data['id']}"
-
-            clean_items.append(data)
-
-        return clean_items
+        # Bind once; the comprehension then does no attribute lookups per item
+        public_url = s3_client.get_public_url
+        return [_fix_gallery_url(data, public_url) for data in results if data]
 
     @staticmethod
     def get_image_download_url(iid: str):
         """
         Fetch an individual image record and generate a temporary download link.
+        Links are cached in Redis, so repeat views are a single GET, and in
+        this process for a few seconds, so hot images don't even need that.
         """
+        with _url_cache_lock:
+            cached_url = _url_cache.get(iid)
+        if cached_url:
+            return cached_url
+
+        cached_url = redis_client.get_presigned_url(iid)
+        if cached_url:
+            with _url_cache_lock:
+                _url_cache[iid] = cached_url
+            return cached_url
+
         img_data = redis_client.get_image(iid)
         if not img_data:
             return None
@@ -204,7 +280,12 @@ class ImageService:
         if not s3_key:
             raise ValueError("Image record missing S3 key — this means it's corrupted.")
 
-        return s3_client.generate_presigned_download_url(s3_key)
+        url = s3_client.generate_presigned_download_url(s3_key, expires_in=PRESIGN_EXPIRES)
+        if not redis_client.cache_presigned_url(iid, url, PRESIGN_CACHE_TTL):
+            return None  # deleted while we were signing
+        with _url_cache_lock:
+            _url_cache[iid] = url
+        return url
 
     @staticmethod
     def delete_image(iid: str, requester_uid: str):
@@ -215,8 +296,8 @@ class ImageService:
         - delete from S3 first
         - delete from Redis second
         """
-        img_data = redis_client.get_image(iid)
-        if not img_data:
+        img_data = redis_client.get_image_fields(iid, ["owner_uid", "key"])
+        if not any(img_data.values()):
             return {"error": "not_found", "code": 404}
 
         if img_data.get("owner_uid") != requester_uid:
@@ -228,9 +309,44 @@ class ImageService:
 
         # Try removing from both storage layers
         try:
+            _forget_urls([iid])
             s3_client.delete_object(s3_key)
-            redis_client.delete_image(iid, requester_uid)
+            # Redis re-checks ownership atomically, in case of a concurrent delete
+            if not redis_client.delete_image(iid, requester_uid):
+                return {"error": "not_found", "code": 404}
             return {"status": "success"}
-        except Exception as e:
-            print(f"Service Error: {e}")
+        except Exception:
+            logger.exception("Delete failed for iid=%s", iid)
             return {"error": "storage_error", "code": 500}
+
+    @staticmethod
+    def delete_images(iids, requester_uid: str):
+        """
+        Bulk delete:
+        - look up owner + S3 key for every image in one pipeline
+        - skip anything missing or owned by someone else
+        - delete the rest from S3 in batches, then from Redis in one pipeline
+        """
+        iids = list(dict.fromkeys(iids))  # drop duplicates, keep order
+        records = redis_client.get_images_fields(iids, ["owner_uid", "key"])
+
+        owned = [
+            (iid, data["key"])
+            for iid, data in zip(iids, records)
+            if data.get("owner_uid") == requester_uid and data.get("key")
+        ]
+
+        deleted = []
+        if owned:
+            try:
+                _forget_urls([iid for iid, _ in owned])
+                failed_keys = set(s3_client.delete_objects([key for _, key in owned]))
+                to_remove = [iid for iid, key in owned if key not in failed_keys]
+                results = redis_client.delete_images(to_remove, requester_uid)
+                deleted = [iid for iid, ok in zip(to_remove, results) if ok]
+            except Exception:
+                logger.exception("Bulk delete failed for uid=%s", requester_uid)
+                return {"error": "storage_error", "code": 500}
+
+        deleted_set = set(deleted)
+        return {"deleted": deleted, "skipped": [iid for iid in iids if iid not in deleted_set]}
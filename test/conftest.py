@@ -0,0 +1,194 @@
+"""
+Shared test doubles. The fakes are built once per module and reset before
+every test that uses them, instead of being rebuilt for each test.
+"""
+
+import os
+import pytest
+from unittest.mock import MagicMock
+
+# Set a dummy bucket name so the S3Client doesn't crash on init
+os.environ.setdefault("AWS_S3_BUCKET_NAME", "test-bucket")
+
+
+# --- MOCKS ---
+class DummyRedis:
+    __slots__ = ("images", "user_images", "presigned", "pending", "deleted",
+                 "users", "usernames", "_r")
+
+    def __init__(self):
+        self.images = {}
+        self.user_images = {}
+        self.presigned = {}
+        self.pending = {}
+        self.deleted = []
+        self.users = {}
+        self.usernames = {}
+
+        # Mock the raw redis connection object (_r)
+        self._r = MagicMock()
+
+    def reset(self):
+        """Back to an empty store; cheaper than building a new one per test."""
+        for store in (self.images, self.user_images, self.presigned, self.pending,
+                      self.deleted, self.users, self.usernames):
+            store.clear()
+        self._r.reset_mock(return_value=True, side_effect=True)
+
+    def register_user(self, uid, username, password_hash, created_at):
+        if username in self.usernames:
+            return False
+        self.usernames[username] = uid
+        self.users[uid] = {
+            "uid": uid,
+            "username": username,
+            "password_hash": password_hash,
+            "created_at": created_at,
+        }
+        return True
+
+    def set_password_hash(self, uid, password_hash):
+        self.users.setdefault(uid, {})["password_hash"] = password_hash
+
+    def store_image(self, iid, owner_uid, key, url, filename, mime_type, created_at):
+        self.images[iid] = {
+            "id": iid,
+            "owner_uid": owner_uid,
+            "key": key,
+            "url": url,
+            "filename": filename,
+            "mime_type": mime_type,
+            "created_at": created_at,
+        }
+        self.user_images.setdefault(owner_uid, []).append(iid)
+
+    def get_user_images(self, uid, limit=50):
+        return list(self.user_images.get(uid, []))[:limit]
+
+    def get_images_batch(self, iids):
+        return [self.images.get(i) for i in iids]
+
+    def get_user_gallery(self, uid, limit=50):
+        return self.get_images_batch(self.get_user_images(uid, limit))
+
+    def get_image(self, iid):
+        return self.images.get(iid)
+
+    def delete_image(self, iid, uid):
+        self.deleted.append((iid, uid))
+        return True
+
+    def get_image_fields(self, iid, fields):
+        data = self.images.get(iid) or {}
+        return {f: data.get(f) for f in fields}
+
+    def get_images_fields(self, iids, fields):
+        return [{f: (self.images.get(i) or {}).get(f) for f in fields} for i in iids]
+
+    def delete_images(self, iids, uid):
+        self.deleted.extend((iid, uid) for iid in iids)
+        return [True] * len(iids)
+
+    def store_pending_upload(self, iid, owner_uid, key, filename, mime_type, ttl):
+        self.pending[iid] = {"owner_uid": owner_uid, "key": key, "filename": filename, "mime": mime_type}
+
+    def get_pending_upload(self, iid):
+        return self.pending.get(iid, {})
+
+    def get_presigned_url(self, iid):
+        return self.presigned.get(iid)
+
+    def cache_presigned_url(self, iid, url, ttl):
+        if iid not in self.images:
+            return False
+        self.presigned[iid] = url
+        return True
+
+
+class DummyS3:
+    __slots__ = ("upload_calls", "download_calls", "deleted")
+
+    def __init__(self):
+        self.upload_calls = []
+        self.download_calls = []
+        self.deleted = []
+
+    def reset(self):
+        self.upload_calls.clear()
+        self.download_calls.clear()
+        self.deleted.clear()
+
+    def generate_presigned_upload_url(self, key, mime_type, expires_in=3600):
+        self.upload_calls.append((key, mime_type))
+        return f"https://upload/{key}"
+
+    def generate_presigned_download_url(self, key, expires_in=3600):
+        self.download_calls.append(key)
+        return f"https://download/{key}"
+
+    def get_public_url(self, key):
+        return f"https://public/{key}"
+
+    def delete_object(self, key):
+        self.deleted.append(key)
+
+    def delete_objects(self, keys):
+        self.deleted.extend(keys)
+        return []
+
+
+# --- FIXTURES ---
+
+# The client classes pull in redis and boto3, so hand them to tests through
+# fixtures instead of importing them while pytest collects.
+@pytest.fixture(scope="session")
+def redis_client_cls():
+    from infrastructure.redis_client import RedisClient
+    return RedisClient
+
+@pytest.fixture(scope="session")
+def s3_client_cls():
+    from infrastructure.s3_client import S3Client
+    return S3Client
+
+@pytest.fixture
+def mock_redis_cls(monkeypatch):
+    """Stands in for redis.Redis, so RedisClient never builds a real client"""
+    import infrastructure.redis_client as rc
+    cls = MagicMock()
+    monkeypatch.setattr(rc.redis, "Redis", cls)
+    return cls
+
+@pytest.fixture
+def mock_redis(mock_redis_cls):
+    """The connection object RedisClient ends up with as self._r"""
+    return mock_redis_cls.return_value
+
+@pytest.fixture
+def mock_script(mock_redis):
+    """What every register_script() call hands back; set .return_value per test"""
+    script = MagicMock()
+    mock_redis.register_script.return_value = script
+    return script
+
+@pytest.fixture(scope="module")
+def _dummy_redis():
+    return DummyRedis()
+
+@pytest.fixture(scope="module")
+def _dummy_s3():
+    return DummyS3()
+
+@pytest.fixture
+def fake_redis(monkeypatch, _dummy_redis):
+    import services
+    _dummy_redis.reset()
+    monkeypatch.setattr(services, "redis_client", _dummy_redis)
+    return _dummy_redis
+
+@pytest.fixture
+def fake_s3(monkeypatch, _dummy_s3):
+    import services
+    _dummy_s3.reset()
+    monkeypatch.setattr(services, "s3_client", _dummy_s3)
+    return _dummy_s3
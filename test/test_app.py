@@ -9,7 +9,7 @@ def client():
         yield client
 
 def _auth_header(uid="u_test"):
-    token = app.signer.dumps({"uid": uid})
+    token = app.issue_api_key(uid)
     return {"X-API-Key": token}
 
 def test_health_check(client):
@@ -17,6 +17,22 @@ def test_health_check(client):
     assert resp.status_code == 200
     assert resp.get_json() == {"status": "ok"}
 
+def test_index_supports_conditional_get(client):
+    first = client.get("/")
+    assert first.status_code == 200
+    assert first.headers["ETag"] == f'"{app.INDEX_ETAG}"'
+    assert "max-age=3600" in first.headers["Cache-Control"]
+
+    again = client.get("/", headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+
+def test_index_is_not_cached_in_debug(client, monkeypatch):
+    monkeypatch.setattr(app.app, "debug", True)
+    resp = client.get("/", headers={"If-None-Match": f'"{app.INDEX_ETAG}"'})
+    assert resp.status_code == 200
+    assert "ETag" not in resp.headers
+    assert resp.headers["Cache-Control"] == "no-cache"
+
 # --- NEW AUTH ROUTE TESTS ---
 def test_register_route_success(client, monkeypatch):
     # Mock AuthService to return success
@@ -29,6 +45,15 @@ def test_register_route_success(client, monkeypatch):
     assert payload["username"] == "me"
     assert "api_key" in payload
 
+def test_register_route_rejects_malformed_json(client):
+    resp = client.post("/api/v1/register", data="{not json", content_type="application/json")
+    assert resp.status_code == 400
+    assert resp.get_json()["error"]["code"] == "validation"
+
+def test_register_route_rejects_oversized_body(client):
+    resp = client.post("/api/v1/register", json={"username": "x" * 70000, "password": "pw"})
+    assert resp.status_code == 413
+
 def test_login_route_success(client, monkeypatch):
     # Mock AuthService to return success
     monkeypatch.setattr(app.AuthService, "login_user", lambda u, p: {"uid": "u_1", "username": u})
@@ -44,6 +69,27 @@ def test_request_upload_requires_api_key(client):
     assert resp.status_code == 401
     assert resp.get_json()["error"]["code"] == "auth"
 
+def test_request_upload_rejects_tampered_api_key(client):
+    # Swap the uid but keep the original signature
+    token = app.issue_api_key("u_victim").replace("u_victim", "u_attacker")
+    resp = client.post(
+        "/api/v1/upload/request",
+        json={"filename": "x", "mime_type": "image/png"},
+        headers={"X-API-Key": token}
+    )
+    assert resp.status_code == 401
+
+def test_malformed_api_keys_skip_the_cache(client):
+    app._verify_api_key.cache_clear()
+    for junk in ("x" * 8192, "u_1.nothex", "u_1." + "0" * 33):
+        resp = client.post(
+            "/api/v1/upload/request",
+            json={"filename": "x", "mime_type": "image/png"},
+            headers={"X-API-Key": junk}
+        )
+        assert resp.status_code == 401
+    assert app._verify_api_key.cache_info().currsize == 0
+
 def test_request_upload_success(client, monkeypatch):
     expected = {"iid": "img_1", "key": "k", "presigned_url": "url", "filename": "f"}
     
@@ -64,17 +110,48 @@ def test_request_upload_success(client, monkeypatch):
     assert resp.status_code == 200
     assert resp.get_json() == expected
 
+def test_complete_upload_requires_iid(client):
+    resp = client.post("/api/v1/upload/complete", json={"key": "k"}, headers=_auth_header())
+    assert resp.status_code == 400
+
+def test_complete_upload_unknown_iid(client, monkeypatch):
+    monkeypatch.setattr(
+        app.ImageService, "finalize_upload", lambda uid, iid: {"error": "not_found", "code": 404}
+    )
+    resp = client.post("/api/v1/upload/complete", json={"iid": "img_x"}, headers=_auth_header())
+    assert resp.status_code == 404
+    assert resp.get_json()["error"]["code"] == "not_found"
+
 def test_redis_check_handles_failure(client, monkeypatch):
-    def broken_ping():
-        raise RuntimeError("boom")
-    monkeypatch.setattr(redis_client, "ping", broken_ping)
+    monkeypatch.setattr(redis_client, "health", lambda: (False, "boom"))
     resp = client.get("/redis-check")
     assert resp.status_code == 500
     body = resp.get_json()
     assert body["error"]["code"] == "redis_unreachable"
+    assert body["error"]["message"] == "boom"
 
 def test_get_image_redirects(client, monkeypatch):
     monkeypatch.setattr(app.ImageService, "get_image_download_url", lambda iid: "http://example.com/img.jpg")
     resp = client.get("/api/v1/image/i1")
     assert resp.status_code == 302
-    assert resp.headers["Location"] == "http://example.com/img.jpg"
\ No newline at end of file
+    assert resp.headers["Location"] == "http://example.com/img.jpg"
+
+def test_bulk_delete_requires_id_list(client):
+    resp = client.delete("/api/v1/me/images", json={"ids": "img_1"}, headers=_auth_header())
+    assert resp.status_code == 400
+    assert resp.get_json()["error"]["code"] == "validation"
+
+def test_bulk_delete_success(client, monkeypatch):
+    def fake_delete_images(iids, uid):
+        assert uid == "u_owner"
+        return {"deleted": iids, "skipped": []}
+
+    monkeypatch.setattr(app.ImageService, "delete_images", fake_delete_images)
+
+    resp = client.delete(
+        "/api/v1/me/images",
+        json={"ids": ["img_1", "img_2"]},
+        headers=_auth_header(uid="u_owner")
+    )
+    assert resp.status_code == 200
+    assert resp.get_json() == {"deleted": ["img_1", "img_2"], "skipped": []}
@@ -1,104 +1,165 @@
 import pytest
 import cli
 import argparse
-import builtins
 import getpass
+import io
 import sys
+import types
 from pathlib import Path
 from unittest.mock import MagicMock
 
-# Attempt to import PIL to create real dummy images for testing
-try:
-    from PIL import Image
-except ImportError:
-    Image = None
+@pytest.fixture(scope="session")
+def pil():
+    """PIL.Image, imported only by the tests that generate real images"""
+    try:
+        from PIL import Image
+    except ImportError:
+        pytest.skip("Pillow not installed, cannot generate test image")
+    return Image
 
 
-@pytest.fixture
-def temp_image(tmp_path):
+@pytest.fixture(scope="session")
+def _red_jpeg_bytes(pil):
+    """A 10x10 red JPEG, encoded once for the whole run"""
+    buf = io.BytesIO()
+    pil.new('RGB', (10, 10), color='red').save(buf, 'JPEG')
+    return buf.getvalue()
+
+# The sample files below are only ever read, so each is written once per run
+
+@pytest.fixture(scope="session")
+def temp_image(tmp_path_factory, _red_jpeg_bytes):
     """Creates a valid 10x10 JPEG image for testing"""
-    if not Image:
-        pytest.skip("Pillow not installed, cannot generate test image")
-    
-    img_path = tmp_path / "valid.jpg"
-    img = Image.new('RGB', (10, 10), color='red')
-    img.save(img_path)
+    img_path = tmp_path_factory.mktemp("image") / "valid.jpg"
+    img_path.write_bytes(_red_jpeg_bytes)
     return img_path
 
-@pytest.fixture
-def temp_text_file(tmp_path):
+@pytest.fixture(scope="session")
+def temp_text_file(tmp_path_factory):
     """Creates a text file disguised as an image"""
-    f = tmp_path / "fake.jpg"
+    f = tmp_path_factory.mktemp("text") / "fake.jpg"
     f.write_text("This is not an image")
     return f
 
-@pytest.fixture
-def temp_heic(tmp_path):
+@pytest.fixture(scope="session")
+def temp_heic(tmp_path_factory):
     """Creates a dummy file with .heic extension"""
-    f = tmp_path / "photo.heic"
+    f = tmp_path_factory.mktemp("heic") / "photo.heic"
     f.write_bytes(b"dummy_heic_content")
     return f
 
+@pytest.fixture(scope="session")
+def processed_image(temp_image):
+    """cli.process_file's result for the valid JPEG, computed once per run"""
+    return cli.process_file(temp_image)
+
+@pytest.fixture(scope="session")
+def empty_ns():
+    """Args for commands that take no options (login)"""
+    return argparse.Namespace()
+
+class _Exit(Exception):
+    """Raised in place of SystemExit by the no_exit fixture"""
+    def __init__(self, code=0):
+        super().__init__(code)
+        self.code = code
+
+@pytest.fixture
+def no_exit(monkeypatch):
+    """Turns sys.exit into a plain exception the test can catch"""
+    def fake_exit(code=0):
+        raise _Exit(code)
+    monkeypatch.setattr(sys, "exit", fake_exit)
+    return _Exit
+
 # --- TEST VALIDATION LOGIC ---
 
-def test_process_file_valid_image(temp_image):
+def test_process_file_valid_image(temp_image, processed_image):
     """Should return the path and correct mime type without cleanup"""
-    path, mime, cleanup = cli.process_file(temp_image)
-    
+    path, mime, cleanup = processed_image
+
     assert path == temp_image
     assert mime == "image/jpeg"
     assert cleanup is False
 
-def test_process_file_rejects_text_file(temp_text_file, capsys):
+def test_process_file_rejects_text_file(temp_text_file, capsys, no_exit):
     """Should exit with error if file is not a real image"""
-    with pytest.raises(SystemExit) as exc:
+    with pytest.raises(no_exit) as exc:
         cli.process_file(temp_text_file)
     
     assert exc.value.code == 1
     captured = capsys.readouterr()
     assert "Invalid or Corrupt File" in captured.out
 
-def test_process_file_rejects_forbidden_mime(tmp_path, capsys):
+def test_process_file_rejects_forbidden_mime(tmp_path, capsys, pil, no_exit):
     """Should reject valid images that are not in the ALLOWED list (like BMP or TIFF)"""
-    if not Image: pytest.skip("Pillow needed")
-    
     bmp_path = tmp_path / "test.bmp"
-    img = Image.new('RGB', (10, 10))
+    img = pil.new('RGB', (10, 10))
     img.save(bmp_path)
     
-    with pytest.raises(SystemExit) as exc:
+    with pytest.raises(no_exit) as exc:
         cli.process_file(bmp_path)
         
     assert exc.value.code == 1
     captured = capsys.readouterr()
     assert "Forbidden file type" in captured.out
 
+@pytest.mark.parametrize("head,expected", [
+    (b"\xff\xd8\xff\xe0" + b"\x00" * 8, "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n\x00\x00\x00\x0d", "image/png"),
+    (b"GIF89a\x01\x00\x01\x00\x00\x00", "image/gif"),
+    (b"RIFF\x24\x00\x00\x00WEBP", "image/webp"),
+    (b"%PDF-1.7\n%\xe2\xe3\xcf", None),
+])
+def test_sniff_mime(head, expected):
+    assert cli.sniff_mime(head) == expected
+
+class FakeConverted:
+    """Stands in for the RGB copy; remembers what save() was given"""
+    def __init__(self):
+        self.save_args = None
+
+    def save(self, *args, **kwargs):
+        self.save_args = args
+
+class FakeImg:
+    """Stands in for the decoded HEIC picture (with alpha)"""
+    mode = "RGBA"
+
+    def __init__(self):
+        self.convert_args = None
+        self.converted = FakeConverted()
+
+    def convert(self, mode):
+        self.convert_args = mode
+        return self.converted
+
+class FakeHeif:
+    def __init__(self, img):
+        self.img = img
+
+    def to_pillow(self):
+        return self.img
+
 def test_process_file_heic_conversion(temp_heic, monkeypatch):
     """Should trigger conversion logic for HEIC files"""
     
-    # Mock Image.open so we don't actually try to convert the dummy file
-    mock_img = MagicMock()
-    mock_converted = MagicMock()
-    
-    # Setup chain: open() -> convert() -> save()
-    mock_img.convert.return_value = mock_converted
-    
-    def fake_open(fp):
-        return mock_img
-
-    monkeypatch.setattr(cli.Image, "open", fake_open)
+    # Fake open_heif so we don't actually try to decode the dummy file.
+    # Chain: open_heif() -> to_pillow() -> convert() -> save()
+    fake_img = FakeImg()
+    monkeypatch.setattr(cli.pillow_heif, "open_heif", lambda fp, **kwargs: FakeHeif(fake_img))
     
     # Run
-    path, mime, cleanup = cli.process_file(temp_heic)
+    buf, mime, converted = cli.process_file(temp_heic)
     
     # Assert
     assert mime == "image/jpeg"
-    assert cleanup is True
-    assert path.suffix == ".jpg" # Should be a temp file ending in .jpg
+    assert converted is True
+    assert isinstance(buf, io.BytesIO)  # Kept in memory, no temp file
     
-    # Verify PIL methods were called
-    mock_img.convert.assert_called_with("RGB")
-    mock_converted.save.assert_called()
+    # Alpha gets dropped, then saved as JPEG into that buffer
+    assert fake_img.convert_args == "RGB"
+    assert fake_img.converted.save_args[:2] == (buf, "JPEG")
 
 # --- TEST COMMANDS (Login / Upload) ---
 
@@ -112,28 +173,38 @@ class DummyResponse:
     def json(self):
         return self._json
 
-def test_cmd_login_flow(monkeypatch, tmp_path, capsys):
+# Nothing mutates it, so every stubbed S3 PUT can hand back the same one
+_OK_RESPONSE = DummyResponse()
+
+def test_cmd_login_flow(monkeypatch, tmp_path, capsys, empty_ns):
     # 1. Setup paths
     monkeypatch.setattr(cli, "KEY_PATH", tmp_path / "keyfile")
+    monkeypatch.setattr(cli, "_API_KEY", None)
 
     # 2. Mock API Request
+    sent = {}
     def fake_api_request(method, path, json_body=None, use_auth=True):
+        sent.update(path=path, body=json_body)
         return {"api_key": "secret_key_123"}
 
     monkeypatch.setattr(cli, "api_request", fake_api_request)
 
-    # 3. Mock Inputs (Username: 'test', New Account?: 'n', Password: 'pw')
-    inputs = iter(["testuser", "n"]) 
-    monkeypatch.setattr(builtins, "input", lambda msg: next(inputs))
+    # 3. Feed the prompts (Username: 'testuser', Have an account?: 'n');
+    #    getpass doesn't read stdin, so it still gets patched
+    monkeypatch.setattr(sys, "stdin", io.StringIO("testuser\nn\n"))
     monkeypatch.setattr(getpass, "getpass", lambda msg: "password123")
 
     # 4. Run
-    cli.cmd_login(argparse.Namespace())
+    cli.cmd_login(empty_ns)
 
     # 5. Assert
     captured = capsys.readouterr()
     assert "Login successful" in captured.out
     assert cli.KEY_PATH.read_text().strip() == "secret_key_123"
+    assert sent == {
+        "path": "/api/v1/register",
+        "body": {"username": "testuser", "password": "password123"},
+    }
 
 def test_cmd_upload_flow(monkeypatch, tmp_path, capsys, temp_image):
     # 1. Mock API calls
@@ -152,13 +223,56 @@ def test_cmd_upload_flow(monkeypatch, tmp_path, capsys, temp_image):
     monkeypatch.setattr(cli, "load_api_key", lambda: "token")
     
     # 2. Mock S3 PUT request
-    monkeypatch.setattr(cli.requests, "put", lambda *_, **__: DummyResponse())
+    monkeypatch.setattr(cli._S3_SESSION, "put", lambda *_, **__: _OK_RESPONSE)
 
     # 3. Run
-    cli.cmd_upload(argparse.Namespace(path=str(temp_image)))
+    cli.cmd_upload(types.SimpleNamespace(path=str(temp_image)))
 
     # 4. Assert
     captured = capsys.readouterr()
     assert "Upload complete" in captured.out
     assert "/api/v1/upload/request" in api_calls
-    assert "/api/v1/upload/complete" in api_calls
\ No newline at end of file
+    assert "/api/v1/upload/complete" in api_calls
+
+def test_cmd_delete_batches_ids(monkeypatch, capsys):
+    monkeypatch.setattr(cli, "DELETE_BATCH", 2)
+    batches = []
+    def fake_api_request(method, path, json_body=None, use_auth=True):
+        batches.append((method, path, json_body["ids"]))
+        return {"deleted": json_body["ids"][:1], "skipped": json_body["ids"][1:]}
+
+    monkeypatch.setattr(cli, "api_request", fake_api_request)
+
+    cli.cmd_delete(types.SimpleNamespace(ids=["a", "b", "a", "c"]))
+
+    assert batches == [
+        ("DELETE", "/api/v1/me/images", ["a", "b"]),
+        ("DELETE", "/api/v1/me/images", ["c"]),
+    ]
+    captured = capsys.readouterr()
+    assert "Deleted 2 image(s)" in captured.out
+    assert "Skipped (not found or not yours): b" in captured.out
+
+def test_api_request_uses_orjson(monkeypatch):
+    sent = {}
+    def fake_request(method, url, data=None, headers=None, timeout=None):
+        sent.update(data=data, headers=headers)
+        return MagicMock(ok=True, content=b'{"data": {"iid": "img_1"}}')
+
+    monkeypatch.setattr(cli._SESSION, "request", fake_request)
+
+    result = cli.api_request("POST", "/api/v1/upload/request", json_body={"a": 1}, use_auth=False)
+
+    assert result == {"iid": "img_1"}
+    assert sent["data"] == b'{"a":1}'
+    assert sent["headers"]["Content-Type"] == "application/json"
+
+def test_load_api_key_reads_file_once(monkeypatch, tmp_path):
+    key_path = tmp_path / "keyfile"
+    key_path.write_text("cached_key\n")
+    monkeypatch.setattr(cli, "KEY_PATH", key_path)
+    monkeypatch.setattr(cli, "_API_KEY", None)
+
+    assert cli.load_api_key() == "cached_key"
+    key_path.unlink()
+    assert cli.load_api_key() == "cached_key"
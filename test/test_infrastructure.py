@@ -1,78 +1,179 @@
 import pytest
-import os
-from unittest.mock import MagicMock, patch, ANY  # <--- FIX: Imported ANY here
-from infrastructure.redis_client import RedisClient
-from infrastructure.s3_client import S3Client
+from unittest.mock import MagicMock, patch, ANY, call  # <--- FIX: Imported ANY here
+
+# The RedisClient / S3Client classes come in as the redis_client_cls /
+# s3_client_cls session fixtures from conftest.py, so redis and boto3 only
+# get imported once a test actually needs them. mock_redis / mock_script
+# (the fake connection and the scripts it registers) live there too.
 
 # --- REDIS CLIENT TESTS ---
 
-@patch("infrastructure.redis_client.redis.from_url")
-def test_redis_init(mock_from_url):
-    os.environ["REDIS_URL"] = "redis://test:6379/0"
-    client = RedisClient()
-    mock_from_url.assert_called_with("redis://test:6379/0", decode_responses=True)
-
-@patch("infrastructure.redis_client.redis.from_url")
-def test_redis_create_user(mock_from_url):
-    mock_redis = MagicMock()
-    mock_from_url.return_value = mock_redis
-    client = RedisClient()
-    client.create_user("u_123", "john_doe", 1000.0)
-    mock_redis.hsetnx.assert_called_with("user:u_123", "username", "john_doe")
-    mock_redis.hset.assert_called()
-
-@patch("infrastructure.redis_client.redis.from_url")
-def test_redis_store_image_uses_pipeline(mock_from_url):
-    mock_redis = MagicMock()
-    mock_pipeline = MagicMock()
-    mock_redis.pipeline.return_value = mock_pipeline
-    mock_from_url.return_value = mock_redis
-
-    client = RedisClient()
+@patch("infrastructure.redis_client.redis.BlockingConnectionPool.from_url")
+def test_redis_init(mock_pool_from_url, mock_redis_cls, monkeypatch, redis_client_cls):
+    monkeypatch.setenv("REDIS_URL", "redis://test:6379/0")
+    client = redis_client_cls()
+    mock_pool_from_url.assert_called_with(
+        "redis://test:6379/0",
+        max_connections=50,
+        decode_responses=True,
+        socket_keepalive=True,
+        health_check_interval=30,
+        socket_connect_timeout=2.0,
+        socket_timeout=5.0,
+    )
+    mock_redis_cls.assert_called_with(connection_pool=mock_pool_from_url.return_value)
+
+def test_redis_create_user(mock_script, mock_redis, redis_client_cls):
+    mock_script.return_value = 1
+    client = redis_client_cls()
+    assert client.create_user("u_123", "john_doe", 1000.0) is True
+    mock_script.assert_called_with(
+        keys=["user:u_123"], args=["john_doe", "u_123", 1000.0]
+    )
+    mock_redis.hsetnx.assert_not_called()
+
+def test_redis_register_user_uses_script(mock_script, redis_client_cls):
+    mock_script.return_value = 0
+    client = redis_client_cls()
+    assert client.register_user("u_1", "bob", "hash", 50) is False
+    mock_script.assert_called_with(
+        keys=["username:bob", "user:u_1"], args=["u_1", "bob", "hash", 50]
+    )
+
+def test_redis_set_password_hash(mock_redis, redis_client_cls):
+    redis_client_cls().set_password_hash("u_1", "new")
+    mock_redis.hset.assert_called_with("user:u_1", "password_hash", "new")
+
+@patch("infrastructure.redis_client.threading.Thread")
+def test_redis_health_checks_once_then_uses_monitor(mock_thread, mock_redis, redis_client_cls):
+    mock_redis.ping.side_effect = RuntimeError("boom")
+    client = redis_client_cls()
+
+    assert client.health() == (False, "boom")
+    assert client.health() == (False, "boom")
+    assert mock_redis.ping.call_count == 1  # later calls read the cached state
+    mock_thread.return_value.start.assert_called_once()
+
+def test_redis_store_image_uses_script(mock_script, redis_client_cls):
+    client = redis_client_cls()
     client.store_image("img_1", "u_1", "key.png", "http://url", "file.png", "image/png", 123)
 
-    mock_redis.pipeline.assert_called()
-    mock_pipeline.hset.assert_called()
-    mock_pipeline.zadd.assert_called()
-    mock_pipeline.execute.assert_called()
+    kwargs = mock_script.call_args.kwargs
+    assert kwargs["keys"] == ["img:img_1", "user:u_1:images", "pending:img_1"]
+    assert kwargs["args"][:2] == ["img_1", 123]
+    fields = dict(zip(kwargs["args"][2::2], kwargs["args"][3::2]))
+    assert fields["owner_uid"] == "u_1"
+    assert fields["created_at"] == 123
+
+def test_redis_store_images_bulk_uses_one_pipeline(mock_script, mock_redis, redis_client_cls):
+    pipe = mock_redis.pipeline.return_value
+
+    client = redis_client_cls()
+    client.store_images_bulk([
+        dict(iid=f"img_{i}", owner_uid="u_1", key=f"k{i}", url="http://url",
+             filename="f.png", mime_type="image/png", created_at=i)
+        for i in range(3)
+    ])
 
-@patch("infrastructure.redis_client.redis.from_url")
-def test_redis_get_user_images(mock_from_url):
-    mock_redis = MagicMock()
-    mock_from_url.return_value = mock_redis
-    client = RedisClient()
+    assert mock_script.call_count == 3
+    assert all(c.kwargs["client"] is pipe for c in mock_script.call_args_list)
+    assert mock_script.call_args.kwargs["keys"][0] == "img:img_2"
+    # The writes go through the script; the pipeline itself is only flushed
+    assert pipe.method_calls == [call.execute()]
+
+def test_redis_get_user_images(mock_redis, redis_client_cls):
+    client = redis_client_cls()
     client.get_user_images("u_1", limit=10)
     mock_redis.zrevrange.assert_called_with("user:u_1:images", 0, 9)
 
+def test_redis_get_user_gallery_parses_script_reply(mock_script, redis_client_cls):
+    mock_script.return_value = [
+        ["img_2", "k2", "http://u2", "b.png", "image/png", "200"],
+        [None, None, None, None, None, None],  # image hash is gone
+    ]
+
+    client = redis_client_cls()
+    gallery = client.get_user_gallery("u_1", limit=10)
+
+    mock_script.assert_called_with(
+        keys=["user:u_1:images"],
+        args=[10, "id", "key", "url", "filename", "mime", "created_at"],
+    )
+    assert gallery == [
+        {"id": "img_2", "key": "k2", "url": "http://u2", "filename": "b.png",
+         "mime": "image/png", "created_at": "200"},
+        {},
+    ]
+
+def test_redis_delete_image_reports_ownership(mock_script, redis_client_cls):
+    mock_script.return_value = 0
+
+    client = redis_client_cls()
+    assert client.delete_image("img_1", "not_owner") is False
+    mock_script.assert_called_with(
+        keys=["img:img_1", "user:not_owner:images", "presign:img_1"],
+        args=["img_1", "not_owner"],
+    )
+
+def test_redis_cache_presigned_url_requires_image(mock_script, redis_client_cls):
+    mock_script.return_value = 0
+
+    client = redis_client_cls()
+    assert client.cache_presigned_url("img_1", "https://signed", 300) is False
+    mock_script.assert_called_with(
+        keys=["presign:img_1", "img:img_1"], args=["https://signed", 300]
+    )
+
 # --- S3 CLIENT TESTS ---
 
-def test_s3_init_requires_bucket_name():
-    if "AWS_S3_BUCKET_NAME" in os.environ:
-        del os.environ["AWS_S3_BUCKET_NAME"]
+def test_s3_init_requires_bucket_name(monkeypatch, s3_client_cls):
+    monkeypatch.delenv("AWS_S3_BUCKET_NAME", raising=False)
     with pytest.raises(ValueError) as exc:
-        S3Client()
+        s3_client_cls()
     assert "environment variable not set" in str(exc.value)
 
 @patch("infrastructure.s3_client.boto3.client")
-def test_s3_init_connects_boto(mock_boto):
-    os.environ["AWS_S3_BUCKET_NAME"] = "my-bucket"
-    os.environ["AWS_REGION"] = "us-west-2"
+def test_s3_init_connects_boto(mock_boto, monkeypatch, s3_client_cls):
+    monkeypatch.setenv("AWS_S3_BUCKET_NAME", "my-bucket")
+    monkeypatch.setenv("AWS_REGION", "us-west-2")
+    monkeypatch.delenv("AWS_ENDPOINT_URL_S3", raising=False)
+    monkeypatch.delenv("AWS_ENDPOINT_URL", raising=False)
     
-    S3Client()
+    s3_client_cls()
   
     mock_boto.assert_called_with(
         "s3", 
         region_name="us-west-2", 
+        endpoint_url=None,
         config=ANY
     )
 
+@pytest.mark.parametrize("env", ["AWS_ENDPOINT_URL_S3", "AWS_ENDPOINT_URL"])
 @patch("infrastructure.s3_client.boto3.client")
-def test_s3_generate_presigned_upload(mock_boto):
-    os.environ["AWS_S3_BUCKET_NAME"] = "test-bucket"
+def test_s3_init_honours_endpoint_override(mock_boto, monkeypatch, s3_client_cls, env):
+    monkeypatch.delenv("AWS_ENDPOINT_URL_S3", raising=False)
+    monkeypatch.delenv("AWS_ENDPOINT_URL", raising=False)
+    monkeypatch.setenv(env, "http://localhost:9000")
+
+    s3_client_cls()
+
+    assert mock_boto.call_args.kwargs["endpoint_url"] == "http://localhost:9000"
+
+@patch("infrastructure.s3_client.boto3.client")
+def test_s3_get_returns_shared_instance(mock_boto, monkeypatch, s3_client_cls):
+    monkeypatch.setenv("AWS_S3_BUCKET_NAME", "my-bucket")
+    monkeypatch.setattr(s3_client_cls, "_instance", None)
+
+    assert s3_client_cls.get() is s3_client_cls.get()
+    assert mock_boto.call_count == 1
+
+@patch("infrastructure.s3_client.boto3.client")
+def test_s3_generate_presigned_upload(mock_boto, monkeypatch, s3_client_cls):
+    monkeypatch.setenv("AWS_S3_BUCKET_NAME", "test-bucket")
     mock_s3 = MagicMock()
     mock_boto.return_value = mock_s3
     
-    client = S3Client()
+    client = s3_client_cls()
     client.generate_presigned_upload_url("uploads/file.jpg", "image/jpeg")
 
     mock_s3.generate_presigned_url.assert_called_with(
@@ -86,12 +187,47 @@ def test_s3_generate_presigned_upload(mock_boto):
     )
 
 @patch("infrastructure.s3_client.boto3.client")
-def test_s3_public_url_formatting(mock_boto):
-    os.environ["AWS_S3_BUCKET_NAME"] = "my-bucket"
-    client = S3Client()
+def test_s3_generate_presigned_download_sets_cache_control(mock_boto, monkeypatch, s3_client_cls):
+    monkeypatch.setenv("AWS_S3_BUCKET_NAME", "test-bucket")
+    mock_s3 = MagicMock()
+    mock_boto.return_value = mock_s3
+
+    client = s3_client_cls()
+    client.generate_presigned_download_url("img/file.jpg", expires_in=600)
+
+    mock_s3.generate_presigned_url.assert_called_with(
+        "get_object",
+        Params={
+            "Bucket": "test-bucket",
+            "Key": "img/file.jpg",
+            "ResponseCacheControl": "private, max-age=600"
+        },
+        ExpiresIn=600
+    )
+
+@pytest.mark.parametrize("key,expected", [
+    ("simple.png", "https://my-bucket.s3.amazonaws.com/simple.png"),
+    ("folder/my file.png", "https://my-bucket.s3.amazonaws.com/folder/my%20file.png"),
+])
+@patch("infrastructure.s3_client.boto3.client")
+def test_s3_public_url_formatting(mock_boto, monkeypatch, s3_client_cls, key, expected):
+    monkeypatch.setenv("AWS_S3_BUCKET_NAME", "my-bucket")
+    client = s3_client_cls()
     
-    url = client.get_public_url("simple.png")
-    assert url == "https://my-bucket.s3.amazonaws.com/simple.png"
+    assert client.get_public_url(key) == expected
+
+@patch("infrastructure.s3_client.boto3.client")
+def test_s3_delete_objects_batches_keys(mock_boto, monkeypatch, s3_client_cls):
+    monkeypatch.setenv("AWS_S3_BUCKET_NAME", "my-bucket")
+    mock_s3 = MagicMock()
+    mock_s3.delete_objects.return_value = {"Errors": [{"Key": "k0"}]}
+    mock_boto.return_value = mock_s3
+
+    client = s3_client_cls()
+    failed = client.delete_objects([f"k{i}" for i in range(1500)])
 
-    url_spaces = client.get_public_url("folder/my file.png")
-    assert url_spaces == "https://my-bucket.s3.amazonaws.com/folder/my%20file.png"
\ No newline at end of file
+    # 1500 keys -> one full batch of 1000 plus one of 500
+    assert mock_s3.delete_objects.call_count == 2
+    first_batch = mock_s3.delete_objects.call_args_list[0].kwargs["Delete"]["Objects"]
+    assert len(first_batch) == 1000
+    assert failed == ["k0", "k0"]
@@ -1,89 +1,17 @@
-import os
 import pytest
-from unittest.mock import MagicMock
 import services
 from services import AuthService, ImageService, Utils
 
-# Set a dummy bucket name so the S3Client doesn't crash on init
-os.environ.setdefault("AWS_S3_BUCKET_NAME", "test-bucket")
-
-# --- MOCKS ---
-class DummyRedis:
-    def __init__(self):
-        self.images = {}
-        self.user_images = {}
-        self.deleted = []
-        
-        # Mock the raw redis connection object (_r)
-        self._r = MagicMock()
-        # Make the pipeline return a mock that we can assert on
-        self.pipeline_mock = MagicMock()
-        self._r.pipeline.return_value = self.pipeline_mock
-
-    def store_image(self, iid, owner_uid, key, url, filename, mime_type, created_at):
-        self.images[iid] = {
-            "id": iid,
-            "owner_uid": owner_uid,
-            "key": key,
-            "url": url,
-            "filename": filename,
-            "mime_type": mime_type,
-            "created_at": created_at,
-        }
-        self.user_images.setdefault(owner_uid, []).append(iid)
-
-    def get_user_images(self, uid, limit=50):
-        return list(self.user_images.get(uid, []))[:limit]
-
-    def get_images_batch(self, iids):
-        return [self.images.get(i) for i in iids]
-
-    def get_image(self, iid):
-        return self.images.get(iid)
-
-    def delete_image(self, iid, uid):
-        self.deleted.append((iid, uid))
-
-
-class DummyS3:
-    def __init__(self):
-        self.upload_calls = []
-        self.download_calls = []
-        self.deleted = []
-
-    def generate_presigned_upload_url(self, key, mime_type):
-        self.upload_calls.append((key, mime_type))
-        return f"https://upload/{key}"
-
-    def generate_presigned_download_url(self, key):
-        self.download_calls.append(key)
-        return f"https://download/{key}"
-
-    def get_public_url(self, key):
-        return f"https://public/{key}"
-
-    def delete_object(self, key):
-        self.deleted.append(key)
-
-
-# --- FIXTURES ---
-
-@pytest.fixture
-def fake_redis(monkeypatch):
-    fake = DummyRedis()
-    monkeypatch.setattr(services, "redis_client", fake)
-    return fake
-
-@pytest.fixture
-def fake_s3(monkeypatch):
-    fake = DummyS3()
-    monkeypatch.setattr(services, "s3_client", fake)
-    return fake
+# DummyRedis/DummyS3 and the fake_redis/fake_s3 fixtures live in conftest.py
 
 @pytest.fixture(autouse=True)
 def fixed_now(monkeypatch):
     monkeypatch.setattr(services, "now", lambda: 123456)
 
+@pytest.fixture(autouse=True)
+def empty_url_cache():
+    services._url_cache.clear()
+
 
 # --- TESTS ---
 
@@ -91,40 +19,75 @@ def test_sanitize_filename_handles_unicode():
     result = Utils.sanitize_filename("Špéciål Name!!.PNG")
     assert result == "special-name.png"
 
+def test_sanitize_filename_ascii_fast_path():
+    assert Utils.sanitize_filename("IMG_1234 (copy).JPG") == "img_1234-copy.jpg"
+
 # --- NEW AUTH TESTS ---
 def test_auth_service_register_user(fake_redis):
-    # Setup: Username does not exist
-    fake_redis._r.exists.return_value = 0 
-    
     result = AuthService.register_user("testuser", "password123")
     
     assert result["username"] == "testuser"
     assert result["uid"].startswith("u_")
     
-    # Verify Redis pipeline was called
-    fake_redis._r.pipeline.assert_called()
-    fake_redis.pipeline_mock.set.assert_called() # username->uid mapping
-    fake_redis.pipeline_mock.hset.assert_called() # user data
-    fake_redis.pipeline_mock.execute.assert_called()
+    # Username mapping and user data were written together
+    assert fake_redis.usernames["testuser"] == result["uid"]
+    user = fake_redis.users[result["uid"]]
+    assert user["username"] == "testuser"
+    assert user["password_hash"] != "password123"
 
 def test_auth_service_register_existing_user(fake_redis):
     # Setup: Username DOES exist
-    fake_redis._r.exists.return_value = 1
+    fake_redis.usernames["taken_user"] = "u_other"
     
     result = AuthService.register_user("taken_user", "pass")
     assert "error" in result
     assert result["error"] == "Username already exists"
+    assert fake_redis.users == {}
+
+def test_auth_service_login_user_argon2(fake_redis):
+    fake_redis._r.get.return_value = "u_1"
+    fake_redis._r.hgetall.return_value = {"password_hash": services.hash_password("pw")}
+
+    assert AuthService.login_user("bob", "pw") == {"uid": "u_1", "username": "bob"}
+    assert AuthService.login_user("bob", "wrong") is None
+    assert fake_redis.users == {}
+
+def test_auth_service_login_user_rehashes_legacy_hash(fake_redis):
+    from werkzeug.security import generate_password_hash
+    fake_redis._r.get.return_value = "u_1"
+    fake_redis._r.hgetall.return_value = {
+        "password_hash": generate_password_hash("pw", method="pbkdf2:sha256:1000")
+    }
 
-def test_initiate_upload_builds_expected_key(fake_s3):
+    assert AuthService.login_user("bob", "pw") == {"uid": "u_1", "username": "bob"}
+    assert fake_redis.users["u_1"]["password_hash"].startswith("$argon2id$")
+
+def test_initiate_upload_builds_expected_key(fake_redis, fake_s3):
     result = ImageService.initiate_upload("u_1", "My Photo.JPG", "image/jpeg")
     assert result["key"].startswith("uploads/u_1/img_")
     assert result["filename"] == "my-photo.jpg"
     assert fake_s3.upload_calls[0][0] == result["key"]
+    assert fake_redis.pending[result["iid"]] == {
+        "owner_uid": "u_1", "key": result["key"], "filename": "my-photo.jpg", "mime": "image/jpeg"
+    }
 
 def test_finalize_upload_stores_metadata(fake_redis, fake_s3):
-    payload = ImageService.finalize_upload("u_1", "img_1", "uploads/u/img/file.png", "file.png", "image/png")
+    fake_redis.pending["img_1"] = {
+        "owner_uid": "u_1", "key": "uploads/u/img/file.png", "filename": "file.png", "mime": "image/png"
+    }
+    payload = ImageService.finalize_upload("u_1", "img_1")
     assert payload == {"id": "img_1", "url": "https://public/uploads/u/img/file.png"}
     assert fake_redis.images["img_1"]["owner_uid"] == "u_1"
+    assert fake_redis.images["img_1"]["filename"] == "file.png"
+
+def test_finalize_upload_rejects_unknown_or_foreign_upload(fake_redis, fake_s3):
+    assert ImageService.finalize_upload("u_1", "img_nope")["error"] == "not_found"
+
+    fake_redis.pending["img_1"] = {
+        "owner_uid": "u_1", "key": "uploads/u/img/file.png", "filename": "file.png", "mime": "image/png"
+    }
+    assert ImageService.finalize_upload("u_intruder", "img_1")["error"] == "forbidden"
+    assert "img_1" not in fake_redis.images
 
 def test_get_user_gallery_refreshes_bad_urls(fake_redis, fake_s3):
     fake_redis.images["img_1"] = {
@@ -134,16 +97,69 @@ def test_get_user_gallery_refreshes_bad_urls(fake_redis, fake_s3):
     gallery = ImageService.get_user_gallery("u_2")
     assert gallery[0]["url"] == "https://public/k1"
 
+def test_get_user_gallery_falls_back_to_proxy_url(fake_redis, fake_s3):
+    fake_redis.images["img_1"] = {"id": "img_1", "owner_uid": "u_2", "url": ""}
+    fake_redis.user_images["u_2"] = ["img_1"]
+    gallery = ImageService.get_user_gallery("u_2")
+    assert gallery[0]["url"] == "/api/v1/image/img_1"
+
 def test_get_image_download_url_requires_key(fake_redis):
     fake_redis.images["img_1"] = {"id": "img_1"}
     with pytest.raises(ValueError):
         ImageService.get_image_download_url("img_1")
 
+def test_get_image_download_url_uses_cache(fake_redis, fake_s3):
+    fake_redis.images["img_1"] = {"id": "img_1", "key": "k1"}
+
+    first = ImageService.get_image_download_url("img_1")
+    second = ImageService.get_image_download_url("img_1")
+
+    assert first == second == "https://download/k1"
+    assert fake_s3.download_calls == ["k1"]  # signed only once
+    assert fake_redis.presigned["img_1"] == first
+
+def test_get_image_download_url_skips_cache_after_delete(fake_redis, fake_s3, monkeypatch):
+    fake_redis.images["img_1"] = {"id": "img_1", "key": "k1"}
+
+    # The image is deleted between the view reading it and caching the link
+    def sign_then_delete(self, key, expires_in=3600):
+        fake_redis.images.clear()
+        return f"https://download/{key}"
+    monkeypatch.setattr(type(fake_s3), "generate_presigned_download_url", sign_then_delete)
+
+    assert ImageService.get_image_download_url("img_1") is None
+    assert fake_redis.presigned == {}
+    assert "img_1" not in services._url_cache
+
+def test_get_image_download_url_local_cache_skips_redis(fake_redis, fake_s3):
+    fake_redis.images["img_1"] = {"id": "img_1", "owner_uid": "owner", "key": "k1"}
+    first = ImageService.get_image_download_url("img_1")
+
+    fake_redis.presigned.clear()  # a Redis hit/miss would now re-sign
+    assert ImageService.get_image_download_url("img_1") == first
+    assert fake_s3.download_calls == ["k1"]
+
+    # Deleting drops the local copy too
+    ImageService.delete_image("img_1", "owner")
+    assert "img_1" not in services._url_cache
+
 def test_delete_image_validates_owner(fake_redis, fake_s3):
     fake_redis.images["img_1"] = {"id": "img_1", "owner_uid": "owner", "key": "k1"}
+    assert ImageService.delete_image("img_missing", "owner")["error"] == "not_found"
     response = ImageService.delete_image("img_1", "other_person")
     assert response["error"] == "forbidden"
     response_ok = ImageService.delete_image("img_1", "owner")
     assert response_ok == {"status": "success"}
     assert fake_s3.deleted == ["k1"]
-    assert fake_redis.deleted[0] == ("img_1", "owner")
\ No newline at end of file
+    assert fake_redis.deleted[0] == ("img_1", "owner")
+
+def test_delete_images_skips_unowned_and_missing(fake_redis, fake_s3):
+    fake_redis.images["img_1"] = {"id": "img_1", "owner_uid": "owner", "key": "k1"}
+    fake_redis.images["img_2"] = {"id": "img_2", "owner_uid": "someone_else", "key": "k2"}
+    fake_redis.images["img_3"] = {"id": "img_3", "owner_uid": "owner", "key": "k3"}
+
+    result = ImageService.delete_images(["img_1", "img_2", "img_3", "img_missing", "img_1"], "owner")
+
+    assert result == {"deleted": ["img_1", "img_3"], "skipped": ["img_2", "img_missing"]}
+    assert fake_s3.deleted == ["k1", "k3"]
+    assert fake_redis.deleted == [("img_1", "owner"), ("img_3", "owner")]